@@ -4,16 +4,38 @@
 #     streamlit run app.py
 
 import base64
+import hashlib
+import itertools
 import json
+import os
+import shutil
+import threading
 from pathlib import Path
 
+import numpy as np
 import streamlit as st
 import streamlit.components.v1 as components
 
+try:                                   # SIMD base64 encoder, optional
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+try:                                   # fast JSON encoder/decoder, optional
+    import orjson
+except ImportError:
+    orjson = None
+
+try:                                   # fast non-cryptographic hash, optional
+    import xxhash
+except ImportError:
+    xxhash = None
+
 # ---------- FOLDER SET-UP ----------
 UPLOAD_DIR      = Path("images")
 ANNOTATION_DIR  = Path("annotations")
 DATASET_DIRS    = [Path("xview_sample"), Path("opensarship_sample"), Path("mstar_sample")]
+STATIC_BG_DIR   = Path(__file__).parent / "static" / "bg"   # served at /app/static/bg/
 
 for d in [UPLOAD_DIR, ANNOTATION_DIR, *DATASET_DIRS]:
     d.mkdir(exist_ok=True)
@@ -32,6 +54,7 @@ def init_state():
         "selected_class"   : "Unlabeled",
         "last_export_path" : "",
         "reset_counter"    : 0,
+        "saved_hashes"     : {},
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -39,46 +62,193 @@ def init_state():
 init_state()
 
 # ---------- HELPERS ----------
+class_options = ["Unlabeled", "Car", "Truck", "Building", "Tank", "Tree"]
+CLASS_IDS     = {name: i + 1 for i, name in enumerate(class_options)}   # COCO ids start at 1
+
+IMAGE_EXTS = frozenset({".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"})
+
+MIME_TYPES = {
+    ".jpg" : "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png" : "image/png",
+    ".tif" : "image/tiff",
+    ".tiff": "image/tiff",
+    ".bmp" : "image/bmp",
+}
+
+# Cached across reruns; mtime/size are part of the key so edited files are re-read.
+# cache_resource hands back the same (immutable) string instead of unpickling a copy per hit.
+@st.cache_resource(max_entries=64)
+def _load_data_url(path_str: str, mtime: float, size: int, suffix: str) -> str:
+    mime   = MIME_TYPES.get(suffix, "application/octet-stream")
+    encode = pybase64.b64encode if pybase64 is not None else base64.b64encode
+    # Encode in bounded chunks so the raw file is never held in memory all at once.
+    # 48 KB is a multiple of 3, so no chunk but the last produces padding.
+    out = bytearray(f"data:{mime};base64,".encode())
+    with open(path_str, "rb") as f:
+        while chunk := f.read(48 * 1024):
+            out += encode(chunk)
+    return out.decode()
+
 def to_data_url(path: Path) -> str:
+    stat = path.stat()
+    return _load_data_url(str(path), stat.st_mtime, stat.st_size, path.suffix.lower())
+
+# Formats Streamlit's static file server sends with a proper image content type
+STATIC_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+# Source path -> static file name currently published for it, shared by all sessions
+@st.cache_resource
+def _published() -> dict:
+    return {}
+
+# Publish the image under ./static once so the browser can fetch (and cache) it by URL.
+# A hard link costs no data copy; a real copy is only made across filesystems.
+@st.cache_resource(max_entries=256)
+def _publish_static(path_str: str, mtime: float, size: int, suffix: str) -> str:
+    digest = hashlib.sha1(f"{path_str}:{mtime}:{size}".encode()).hexdigest()[:16]
+    name   = f"{digest}{suffix}"
+    dest   = STATIC_BG_DIR / name
+    if not dest.exists():
+        STATIC_BG_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.unlink(missing_ok=True)    # left over from an interrupted attempt
+        try:
+            try:
+                os.link(path_str, tmp)
+            except OSError:
+                shutil.copyfile(path_str, tmp)
+            os.replace(tmp, dest)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            raise
+    # An edited or re-uploaded file gets a new name; drop the copy it supersedes
+    published = _published()
+    old = published.get(path_str)
+    if old is not None and old != name:
+        (STATIC_BG_DIR / old).unlink(missing_ok=True)
+    published[path_str] = name
+    return f"/app/static/bg/{name}"
+
+# URL for the canvas background; falls back to an inline data URL when static serving
+# is off or the file can't be published
+def to_image_url(path: Path) -> str:
+    suffix = path.suffix.lower()
+    if st.get_option("server.enableStaticServing") and suffix in STATIC_SUFFIXES:
+        stat = path.stat()
+        args = (str(path.resolve()), stat.st_mtime, stat.st_size, suffix)
+        try:
+            url = _publish_static(*args)
+            if not (STATIC_BG_DIR / url.rsplit("/", 1)[1]).exists():   # removed while running
+                _publish_static.clear()
+                url = _publish_static(*args)
+            return url
+        except OSError:
+            pass
+    return to_data_url(path)
+
+# Image identity: dataset folder and file name, plus a hash of the first 64 KB and the size.
+# The path scope keeps byte-identical files (e.g. duplicated samples) from sharing annotations.
+def image_key(path: Path, size: int) -> str:
     with open(path, "rb") as f:
-        return "data:image/png;base64," + base64.b64encode(f.read()).decode()
+        head = f.read(65536)
+    if xxhash is not None:
+        digest = xxhash.xxh3_64_hexdigest(head)
+    else:
+        digest = hashlib.blake2b(head, digest_size=8).hexdigest()
+    return f"{path.parent.name}/{path.name}:{digest}:{size}"
+
+# One scandir pass per directory, re-run only when the directory's mtime changes.
+# Plain strings keep the cached value cheap to pickle; callers wrap in Path as needed.
+@st.cache_data(ttl=30)
+def list_images(dir_str: str, dir_mtime: int) -> list[str]:
+    with os.scandir(dir_str) as it:
+        entries = [e for e in it
+                   if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_EXTS]
+    # Sort on plain lowercase names; Path objects are only built for the final list
+    entries.sort(key=lambda e: e.name.lower())
+    return [e.path for e in entries]
+
+# Cached per index, so a rerun only unpickles one path and a count instead of the full listing.
+# Same TTL as list_images; without it, lookups for directories no longer viewed never expire.
+@st.cache_data(ttl=30, max_entries=1024)
+def nth_image(dir_str: str, dir_mtime: int, idx: int):
+    images = list_images(dir_str, dir_mtime)
+    if not images:
+        return None, 0
+    return Path(images[max(0, min(idx, len(images) - 1))]), len(images)
 
-def get_class_id(name):                # class_options defined later
-    return class_options.index(name) + 1
+# orjson when installed (returns bytes directly), stdlib json otherwise
+def dump_json(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode()
+
+get_class_id = CLASS_IDS.__getitem__
+
+# Returns the file's (mtime_ns, size) so a later save can tell if another session wrote it since
+def _write_file(path: Path, payload: bytes):
+    try:
+        path.write_bytes(payload)
+    except FileNotFoundError:          # folder removed since _created_dirs recorded it
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(payload)
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+# True when `path` still has the (mtime_ns, size) this session's last write left it with
+def _unchanged_since(path: Path, written) -> bool:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return False
+    return (stat.st_mtime_ns, stat.st_size) == written
+
+# Annotation folders already made by this process. The script re-executes on every
+# rerun, so a plain module-level set would start empty each time.
+@st.cache_resource
+def _created_dirs() -> set:
+    return set()
 
 def get_annotation_path(img_path: Path) -> Path:
     dataset_name = st.session_state.selected_dataset.name
     class_name   = st.session_state.selected_class
     save_dir     = ANNOTATION_DIR / dataset_name / class_name
-    save_dir.mkdir(parents=True, exist_ok=True)
+    created      = _created_dirs()
+    if save_dir not in created:
+        save_dir.mkdir(parents=True, exist_ok=True)
+        created.add(save_dir)
     return save_dir / f"{img_path.stem}_annotations.json"
 
-# Shoelace formula to compute polygon area
-def polygon_area(points):
+# Shoelace area and COCO bbox [x_min, y_min, width, height], read from one array in one call
+def polygon_metrics(points):
     n = len(points)
-    area = 0
-    for i in range(n):
-        x1, y1 = points[i]
-        x2, y2 = points[(i + 1) % n]
-        area += x1 * y2 - y1 * x2
-    return abs(area) / 2
-
-# Compute bounding box from polygon points: [x_min, y_min, width, height]
-def polygon_bbox(points):
-    xs = [p[0] for p in points]
-    ys = [p[1] for p in points]
-    x_min, x_max = min(xs), max(xs)
-    y_min, y_max = min(ys), max(ys)
-    return [x_min, y_min, x_max - x_min, y_max - y_min]
+    if n < 4:                          # small polygons: one plain loop tracks all four extremes
+        acc = 0.0
+        x_min = x_max = float(points[0][0])
+        y_min = y_max = float(points[0][1])
+        for i in range(n):
+            x1, y1 = points[i]
+            x2, y2 = points[(i + 1) % n]
+            acc += x1 * y2 - y1 * x2
+            x_min, x_max = min(x_min, x1), max(x_max, x1)
+            y_min, y_max = min(y_min, y1), max(y_max, y1)
+        return float(abs(acc) / 2), [float(x_min), float(y_min), float(x_max - x_min), float(y_max - y_min)]
+    a = np.asarray(points, dtype=np.float64)
+    x, y = a[:, 0], a[:, 1]
+    area = float(0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+    mn, mx = a.min(0), a.max(0)
+    return area, [float(mn[0]), float(mn[1]), float(mx[0] - mn[0]), float(mx[1] - mn[1])]
 
 def save_annotation(img_path: Path, data: dict):
+    category_id = get_class_id(st.session_state.selected_class)   # same for every annotation
     coco_format = {
         "images": [{
             "id": 1, "file_name": img_path.name, "width": 800, "height": 533
         }],
         "annotations": [],
         "categories": [{
-            "id": get_class_id(st.session_state.selected_class),
+            "id": category_id,
             "name": st.session_state.selected_class,
             "supercategory": "none",
         }],
@@ -96,18 +266,19 @@ def save_annotation(img_path: Path, data: dict):
             h = abs(h)
         coco_format["annotations"].append({
             "id": ann_id, "image_id": 1,
-            "category_id": get_class_id(st.session_state.selected_class),
+            "category_id": category_id,
             "bbox": [x, y, w, h], "segmentation": [],
             "area": w * h, "iscrowd": 0,
         })
         ann_id += 1
-    for p in data.get("polys", []):
-        segmentation = [coord for pt in p for coord in pt]
-        area = polygon_area(p)
-        bbox = polygon_bbox(p)
+    for pts in data.get("polys", []):
+        # Canvas polygons are [[x, y], ...]; area and bbox are computed here from the
+        # same points, so they always agree with the segmentation written out
+        segmentation = list(itertools.chain.from_iterable(pts))
+        area, bbox   = polygon_metrics(pts)
         coco_format["annotations"].append({
             "id": ann_id, "image_id": 1,
-            "category_id": get_class_id(st.session_state.selected_class),
+            "category_id": category_id,
             "bbox": bbox,
             "segmentation": [segmentation],
             "area": area,
@@ -115,8 +286,13 @@ def save_annotation(img_path: Path, data: dict):
         })
         ann_id += 1
     json_path = get_annotation_path(img_path)
-    with open(json_path, "w") as f:
-        json.dump(coco_format, f, indent=2)
+    payload   = dump_json(coco_format)
+    # Saving identical annotations again skips the disk write, unless the file was
+    # changed since (annotation files are shared by every session)
+    h    = hash(payload)
+    prev = st.session_state.saved_hashes.get(str(json_path))    # (hash, (mtime_ns, size))
+    if prev is None or prev[0] != h or not _unchanged_since(json_path, prev[1]):
+        st.session_state.saved_hashes[str(json_path)] = (h, _write_file(json_path, payload))
     st.session_state.last_export_path = str(json_path)
 
 # ---------- UI AND NAVIGATION ----------
@@ -129,199 +305,126 @@ for ds in DATASET_DIRS:
 uploaded = st.sidebar.file_uploader("Upload an image", type=["png", "jpg", "jpeg", "JPG", "JPEG", "PNG"])
 if uploaded:
     dest = UPLOAD_DIR / uploaded.name
-    dest.write_bytes(uploaded.getbuffer())
+    # The uploader keeps its file across reruns; write each upload once
+    if st.session_state.get("_uploaded_id") != uploaded.file_id:
+        # Write beside the target and swap it in: the old inode may be hard-linked into static/bg
+        tmp = dest.with_name(f".{dest.name}.tmp")
+        try:
+            # A buffered writer passes the memoryview straight through (no bytes() copy)
+            # and keeps writing until all of it is on disk
+            with open(tmp, "wb") as f:
+                f.write(uploaded.getbuffer())
+            os.replace(tmp, dest)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            raise
+        st.session_state["_uploaded_id"] = uploaded.file_id
+        list_images.clear()                  # don't rely on mtime granularity to see the new file
+        nth_image.clear()
     st.session_state.selected_dataset = UPLOAD_DIR
     st.session_state.current_index = 0
 
 DEFAULT_IMG = Path("default.jpg")
+image_count = 0
 
 if st.session_state.selected_dataset:
-    # Add support for more file extensions including uppercase variants
-    images = (
-        sorted(st.session_state.selected_dataset.glob("*.jpg")) +
-        sorted(st.session_state.selected_dataset.glob("*.JPG")) +
-        sorted(st.session_state.selected_dataset.glob("*.jpeg")) +
-        sorted(st.session_state.selected_dataset.glob("*.JPEG")) +
-        sorted(st.session_state.selected_dataset.glob("*.png")) +
-        sorted(st.session_state.selected_dataset.glob("*.PNG")) +
-        sorted(st.session_state.selected_dataset.glob("*.tif")) +
-        sorted(st.session_state.selected_dataset.glob("*.TIF")) +
-        sorted(st.session_state.selected_dataset.glob("*.tiff")) +
-        sorted(st.session_state.selected_dataset.glob("*.TIFF")) +
-        sorted(st.session_state.selected_dataset.glob("*.bmp")) +
-        sorted(st.session_state.selected_dataset.glob("*.BMP"))
-    )
+    # Extension match is case-insensitive, so .JPG/.PNG etc. are picked up too
+    dataset = st.session_state.selected_dataset
+    bg_path, image_count = nth_image(str(dataset), dataset.stat().st_mtime_ns,
+                                     st.session_state.current_index)
     
     # Debug information
-    if not images:
+    if not image_count:
         st.warning(f"No supported images found in {st.session_state.selected_dataset}")
-        st.info("Files in directory: " + ", ".join([f.name for f in st.session_state.selected_dataset.iterdir() if f.is_file()][:10]))
+        with os.scandir(dataset) as it:      # DirEntry.is_file() uses d_type, no stat per file
+            names = list(itertools.islice((e.name for e in it if e.is_file()), 10))
+        st.info("Files in directory: " + ", ".join(names))
         st.info("Supported formats: .jpg/.JPG, .jpeg/.JPEG, .png/.PNG, .tif/.TIF, .tiff/.TIFF, .bmp/.BMP")
         bg_path = DEFAULT_IMG
     else:
-        current_index = max(0, min(st.session_state.current_index, len(images) - 1))
+        current_index = max(0, min(st.session_state.current_index, image_count - 1))
         st.session_state.current_index = current_index
-        bg_path = images[current_index]
-        st.markdown(f"### Image {current_index + 1} of {len(images)}: `{bg_path.name}`")
+        st.markdown(f"### Image {current_index + 1} of {image_count}: `{bg_path.name}`")
 else:
     st.info("Please select a dataset or upload an image to begin.")
     bg_path = DEFAULT_IMG
 
-if not bg_path.exists():
+# The stat doubles as the existence check, so a rerun costs one syscall here
+try:
+    bg_stat = bg_path.stat()
+except FileNotFoundError:
     st.stop()
 
-img_url = to_data_url(bg_path)
-img_key = str(bg_path.resolve())
+# Only rebuild the background URL and key when the image (or its contents) changes
+bg_fp   = (str(bg_path), bg_stat.st_mtime_ns)
+if st.session_state.get("_bg_fp") != bg_fp:
+    st.session_state["_bg_url"] = to_image_url(bg_path)
+    st.session_state["_bg_key"] = image_key(bg_path, bg_stat.st_size)
+    st.session_state["_bg_fp"]  = bg_fp
+img_url = st.session_state["_bg_url"]
+img_key = st.session_state["_bg_key"]
 if img_key not in st.session_state.annotations_dict:
     st.session_state.annotations_dict[img_key] = {"rects": [], "polys": []}
-annotations = st.session_state.annotations_dict[img_key]
 
-class_options = ["Unlabeled", "Car", "Truck", "Building", "Tank", "Tree"]
-st.selectbox("Class Label", class_options,
-             index=class_options.index(st.session_state.selected_class),
-             key="selected_class")
-
-st.markdown("### Annotation Tools")
-c0, c1, c2, _, _ = st.columns(5)
-if c0.button("Rectangular"):
-    st.session_state.mode = "rect"
-if c1.button("Polygonal"):
-    st.session_state.mode = "polygon"
-if c2.button("Reset Annotations"):
-    st.session_state.annotations_dict[img_key] = {"rects": [], "polys": []}
-    st.session_state["annotation_json"] = json.dumps({"rects": [], "polys": []})
-    st.session_state.reset_counter += 1
-    st.rerun()
-
-mode = st.session_state.mode
-st.write(f"**Current mode:** `{mode}`")
-
-# ---------- CANVAS + LIVE COORD DISPLAY ----------
-canvas_html = f"""
-<canvas id="canvas" width="800" height="533"
-        style="border:1px solid #888; background:url('{img_url}'); background-size:cover;"></canvas>
-
-<textarea id="coordsBox"
-          style="width:800px;height:70px;margin-top:4px;" readonly></textarea>
-
-<textarea id="jsonData" style="display:none;"></textarea>
-
-<script>
-const canvas    = document.getElementById("canvas");
-const ctx       = canvas.getContext("2d");
-const coordsBox = document.getElementById("coordsBox");
-const jsonData  = document.getElementById("jsonData");
-const mode      = "{mode}";
-let rects       = {json.dumps(annotations['rects'])};
-let polys       = {json.dumps(annotations['polys'])};
-let curPoly     = [];
-let startX, startY, isDrag = false;
-
-function formatPointsFlat(points) {{
-    return points.flat().join(", ");
-}}
-
-function updateCoordsBox() {{
-    const formattedRects = rects.map(r => {{
-        const [x, y, w, h] = r;
-        return `[${{x}}, ${{y}}, ${{w}}, ${{h}}]`;
-    }});
-    const formattedPolys = polys.map(p => JSON.stringify(p));
-    const formattedCurPoly = curPoly.length > 1 ? [JSON.stringify(curPoly)] : [];
-    const combined = [...formattedRects, ...formattedPolys, ...formattedCurPoly];
-    coordsBox.value = combined.join("\\n");
-    jsonData.value = JSON.stringify({{rects: rects, polys: polys}});
-}}
-
-function drawPolyPath(pts, closed) {{
-    ctx.beginPath();
-    ctx.moveTo(pts[0][0], pts[0][1]);
-    for (let i = 1; i < pts.length; i++) ctx.lineTo(pts[i][0], pts[i][1]);
-    if (closed) ctx.closePath();
-    ctx.stroke();
-}}
-
-function redrawAll() {{
-    ctx.clearRect(0, 0, canvas.width, canvas.height);
-    ctx.lineWidth = 3; ctx.strokeStyle = "black";
-    rects.forEach(([x,y,w,h]) => ctx.strokeRect(x,y,w,h));
-    polys.forEach(pts => drawPolyPath(pts, true));
-    if (curPoly.length > 1) drawPolyPath(curPoly, false);
-    updateCoordsBox();
-}}
-
-canvas.addEventListener("mousedown", e => {{
-    if (mode === "rect") {{
-        startX = e.offsetX; startY = e.offsetY; isDrag = true;
-    }} else {{
-        curPoly.push([e.offsetX, e.offsetY]); redrawAll();
-    }}
-}});
-
-canvas.addEventListener("mousemove", e => {{
-    if (mode === "rect" && isDrag) {{
-        redrawAll();
-        ctx.strokeRect(startX, startY, e.offsetX - startX, e.offsetY - startY);
-    }}
-}});
-
-canvas.addEventListener("mouseup", e => {{
-    if (mode === "rect" && isDrag) {{
-        rects = [[startX, startY, e.offsetX - startX, e.offsetY - startY]];
-        isDrag = false;
-        redrawAll();
-    }}
-}});
-
-canvas.addEventListener("dblclick", e => {{
-    if (mode === "polygon" && curPoly.length > 2) {{
-        polys.push([...curPoly]); curPoly = []; redrawAll();
-    }}
-}});
-
-redrawAll();
-</script>
-"""
-
-# ---------- LAYOUT: BUTTONS BESIDE THE CANVAS ----------
-prev_col, canvas_col, next_col = st.columns([1, 10, 1])
-
-with prev_col:
-    if st.button("⬅️", key="prev_btn"):
+# ---------- CANVAS COMPONENT ----------
+# Served from ./frontend; the iframe survives reruns and only receives changed props,
+# and it sends committed annotations back as its value. Declared once per process
+# rather than re-registered on every rerun.
+@st.cache_resource
+def _declare_canvas():
+    return components.declare_component(
+        "annotation_canvas", path=str(Path(__file__).parent / "frontend"))
+
+annotation_canvas = _declare_canvas()
+
+# ---------- LAYOUT: TOOLS AND CANVAS ----------
+# Class, mode and canvas interactions rerun only this fragment; the image URL and key
+# are computed once by the full script and passed in
+@st.fragment
+def annotation_panel(img_url: str, img_key: str, image_count: int):
+    st.selectbox("Class Label", class_options,
+                 index=get_class_id(st.session_state.selected_class) - 1,
+                 key="selected_class")
+
+    st.markdown("### Annotation Tools")
+    c0, c1, c2, _, _ = st.columns(5)
+    if c0.button("Rectangular"):
+        st.session_state.mode = "rect"
+    if c1.button("Polygonal"):
+        st.session_state.mode = "polygon"
+    if c2.button("Reset Annotations"):
         st.session_state.annotations_dict[img_key] = {"rects": [], "polys": []}
-        st.session_state["annotation_json"] = json.dumps({"rects": [], "polys": []})
-        st.session_state.current_index = max(0, st.session_state.current_index - 1)
-        st.rerun()
-
-with canvas_col:
-    components.html(
-        canvas_html + f"<!-- {st.session_state.reset_counter} -->",
-        height=680,
-        scrolling=False,
-    )
-
-with next_col:
-    if st.button("➡️", key="next_btn"):
-        st.session_state.annotations_dict[img_key] = {"rects": [], "polys": []}
-        st.session_state["annotation_json"] = json.dumps({"rects": [], "polys": []})
         st.session_state.reset_counter += 1
-        st.session_state.current_index = min(len(images) - 1, st.session_state.current_index + 1)
-        st.rerun()
-
-# ---------- HIDDEN TEXTAREA & SAVE ----------
-annotation_json = st.text_area(
-    "Annotation Data (hidden)",
-    value=json.dumps(annotations),
-    key="annotation_json",
-    height=68,
-    label_visibility="collapsed"
-)
-
+        st.rerun(scope="fragment")     # only fragment-owned state changed
+
+    mode = st.session_state.mode
+    st.write(f"**Current mode:** `{mode}`")
+
+    # Prev/next live inside the component, so navigating is a component value like any other
+    value = annotation_canvas(img_url=img_url, img_key=img_key, mode=mode,
+                              reset_gen=st.session_state.reset_counter,
+                              key="annotation_canvas", default=None)
+    # The last value sticks around across reruns; apply each one once, and only to its own image
+    if value and value["img_key"] == img_key and value["stamp"] != st.session_state.get("_canvas_stamp"):
+        st.session_state["_canvas_stamp"] = value["stamp"]
+        action = value.get("action")
+        if action is None:
+            st.session_state.annotations_dict[img_key] = {"rects": value["rects"], "polys": value["polys"]}
+        else:
+            st.session_state.annotations_dict[img_key] = {"rects": [], "polys": []}
+            st.session_state.reset_counter += 1   # canvas drops its shapes too, even if the index can't move
+            if action == "next":
+                st.session_state.current_index = max(0, min(image_count - 1, st.session_state.current_index + 1))
+            else:
+                st.session_state.current_index = max(0, st.session_state.current_index - 1)
+            st.rerun()                 # the new image's URL and key are resolved outside the fragment
+
+annotation_panel(img_url, img_key, image_count)
+
+# ---------- SAVE ----------
 if st.button("Save Annotations from Canvas"):
     try:
-        data = json.loads(annotation_json)
-        st.session_state.annotations_dict[img_key] = data
-        save_annotation(bg_path, data)
+        save_annotation(bg_path, st.session_state.annotations_dict[img_key])
         st.success(f"Annotations saved to {st.session_state.last_export_path}")
     except Exception as e:
         st.error(f"Failed to save annotations: {e}")
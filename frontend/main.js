@@ -0,0 +1,188 @@
+// main.js – Annotation canvas as a Streamlit custom component
+// -----------------------------------------------------------------
+// Plain JS, no build step: talks to Streamlit with the same postMessage
+// protocol streamlit-component-lib uses. The iframe (and the drawing state
+// in it) survives reruns; Python only sends props and gets annotations back.
+
+const canvas    = document.getElementById("canvas");
+const ctx       = canvas.getContext("2d");
+const overlay   = document.getElementById("overlay");
+const octx      = overlay.getContext("2d");
+const coordsBox = document.getElementById("coordsBox");
+
+let props    = {};                     // last args received from Python
+let mode     = "rect";
+let storeKey = null;                   // localStorage key of the current image
+let draftKey = null;
+let resetGen = null;
+let rects    = [];
+let polys    = [];
+let curPoly  = [];
+let startX, startY, isDrag = false;
+
+// ---------- STREAMLIT PROTOCOL ----------
+function sendMessage(type, data) {
+    window.parent.postMessage({isStreamlitMessage: true, type: type, ...data}, "*");
+}
+
+function setComponentValue(value) {
+    sendMessage("streamlit:setComponentValue", {value: value, dataType: "json"});
+}
+
+// Only touch what changed: a new image or reset reloads state, a mode change just flips the mode
+function onRender(args) {
+    const prev = props;
+    props = args;                      // restored drawings below are reported under the new img_key
+    if (args.img_url !== prev.img_url) {
+        canvas.style.backgroundImage = `url('${args.img_url}')`;
+    }
+    mode = args.mode;
+    const key = "annotations:" + args.img_key;
+    if (key !== storeKey || args.reset_gen !== resetGen) {
+        // A new generation for the same image means Python reset it: drop what was stored
+        if (key === storeKey) clearStored();
+        storeKey = key;
+        draftKey = key + ":draft";
+        resetGen = args.reset_gen;
+        const stored = loadAnnotationData();
+        rects   = stored.rects;
+        polys   = stored.polys.map(p => Array.isArray(p) ? p : p.pts);   // older entries stored {pts, bbox, area}
+        curPoly = loadDraft();
+        isDrag  = false;
+        octx.clearRect(0, 0, overlay.width, overlay.height);
+        redrawAll();
+        // Drawings restored from an earlier visit are reported so Python can save them
+        if (rects.length || polys.length) updateAnnotationData();
+    }
+}
+
+window.addEventListener("message", event => {
+    if (event.data && event.data.type === "streamlit:render") onRender(event.data.args);
+});
+
+// ---------- PERSISTENCE ----------
+// Annotations live in localStorage per image. Resets and navigation remove the stored
+// entries rather than just outdating them, so a reload or a new session can't bring them back.
+function loadAnnotationData() {
+    try {
+        const saved = JSON.parse(localStorage.getItem(storeKey));
+        if (saved) return saved;
+    } catch (err) {}
+    return {rects: [], polys: []};
+}
+
+function clearStored() {
+    try {
+        localStorage.removeItem(storeKey);
+        localStorage.removeItem(draftKey);
+    } catch (err) {}
+}
+
+// The unfinished polygon is kept under its own key so a reload doesn't discard it,
+// and saving it stays cheap however many shapes are committed
+function loadDraft() {
+    try {
+        const saved = JSON.parse(localStorage.getItem(draftKey));
+        if (saved) return saved.pts;
+    } catch (err) {}
+    return [];
+}
+
+function saveDraft() {
+    try {
+        localStorage.setItem(draftKey, JSON.stringify({pts: curPoly}));
+    } catch (err) {}
+}
+
+function updateAnnotationData() {
+    try {
+        localStorage.setItem(storeKey, JSON.stringify({rects: rects, polys: polys}));
+    } catch (err) {}
+    // stamp lets Python tell a new value from the one it already applied
+    setComponentValue({img_key: props.img_key, rects: rects, polys: polys, stamp: Date.now()});
+}
+
+// ---------- DRAWING ----------
+function updateCoordsBox() {
+    const formattedRects = rects.map(r => {
+        const [x, y, w, h] = r;
+        return `[${x}, ${y}, ${w}, ${h}]`;
+    });
+    const formattedPolys = polys.map(p => JSON.stringify(p));
+    const formattedCurPoly = curPoly.length > 1 ? [JSON.stringify(curPoly)] : [];
+    const combined = [...formattedRects, ...formattedPolys, ...formattedCurPoly];
+    coordsBox.value = combined.join("\n");
+}
+
+// Coalesce coordsBox rebuilds to at most one per animation frame
+let coordsDirty = false;
+function scheduleCoords() {
+    if (coordsDirty) return;
+    coordsDirty = true;
+    requestAnimationFrame(() => { coordsDirty = false; updateCoordsBox(); });
+}
+
+function drawPolyPath(pts, closed) {
+    ctx.beginPath();
+    ctx.moveTo(pts[0][0], pts[0][1]);
+    for (let i = 1; i < pts.length; i++) ctx.lineTo(pts[i][0], pts[i][1]);
+    if (closed) ctx.closePath();
+    ctx.stroke();
+}
+
+function redrawAll() {
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.lineWidth = 3; ctx.strokeStyle = "black";
+    rects.forEach(([x,y,w,h]) => ctx.strokeRect(x,y,w,h));
+    polys.forEach(p => drawPolyPath(p, true));
+    if (curPoly.length > 1) drawPolyPath(curPoly, false);
+    scheduleCoords();
+}
+
+octx.lineWidth = 3; octx.strokeStyle = "black";
+
+overlay.addEventListener("mousedown", e => {
+    if (mode === "rect") {
+        startX = e.offsetX; startY = e.offsetY; isDrag = true;
+    } else {
+        curPoly.push([e.offsetX, e.offsetY]); redrawAll();
+        saveDraft();
+    }
+});
+
+overlay.addEventListener("mousemove", e => {
+    if (mode === "rect" && isDrag) {
+        octx.clearRect(0, 0, overlay.width, overlay.height);
+        octx.strokeRect(startX, startY, e.offsetX - startX, e.offsetY - startY);
+    }
+});
+
+overlay.addEventListener("mouseup", e => {
+    if (mode === "rect" && isDrag) {
+        rects = [[startX, startY, e.offsetX - startX, e.offsetY - startY]];
+        isDrag = false;
+        octx.clearRect(0, 0, overlay.width, overlay.height);
+        redrawAll();
+        updateAnnotationData();
+    }
+});
+
+overlay.addEventListener("dblclick", e => {
+    if (mode === "polygon" && curPoly.length > 2) {
+        polys.push([...curPoly]); curPoly = []; redrawAll();
+        updateAnnotationData();
+        saveDraft();
+    }
+});
+
+// Navigation is reported like any other value; Python clears this image's annotations,
+// moves the index and reruns, so the stored copy goes too
+function navigate(action) {
+    clearStored();
+    setComponentValue({img_key: props.img_key, action: action, stamp: Date.now()});
+}
+document.getElementById("prevBtn").addEventListener("click", () => navigate("prev"));
+document.getElementById("nextBtn").addEventListener("click", () => navigate("next"));
+
+sendMessage("streamlit:componentReady", {apiVersion: 1});
+sendMessage("streamlit:setFrameHeight", {height: document.body.scrollHeight});